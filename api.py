@@ -3,19 +3,112 @@ import time
 import hmac
 import hashlib
 import logging
-import pandas as pd
+import os
 import config  # ✅ Usa config.py invece di config.json
+from candles import candle_store
+from scheduler import TIMEFRAME_SECONDS, ApiBudget
+from replay import JournalRecorder
+from state_journal import get_journal
+import resilience
+from resilience import backoff_delay, classify_status, get_breaker, get_latency_tracker, hedged_call, is_hedgeable, timeout_for
 
 # ✅ Configurazione API
 API_KEY = config.API_KEY
 API_SECRET = config.API_SECRET
 BASE_URL = config.BASE_URL
 MAX_RETRIES = 3  # Numero massimo di tentativi in caso di errore
+resilience.ENDPOINT_TIMEOUTS.update(getattr(config, "ENDPOINT_TIMEOUTS", {}))  # ✅ Timeout personalizzati per endpoint
 
 print(f"🔑 API_KEY: {API_KEY[:5]}****")  # Mostra solo le prime cifre
 print(f"🔐 API_SECRET: {API_SECRET[:5]}****")
 print(f"🌍 BASE_URL: {BASE_URL}")
 
+_request_budget = ApiBudget()  # ✅ Budget globale: ogni tentativo HTTP consuma un token
+_recorder = None  # ✅ Journal delle richieste attivo in modalità registrazione
+_replayer = None  # ✅ Sorgente delle risposte in modalità replay
+
+# 📌 Budget condiviso delle richieste API
+def get_request_budget():
+    """ Restituisce il budget consumato da make_request. """
+    return _request_budget
+
+def set_request_budget(budget):
+    """ Sostituisce il budget di make_request (es. con quello del coordinatore in modalità shard). """
+    global _request_budget
+    _request_budget = budget
+
+# 📌 Registrazione e replay delle richieste API
+def start_recording(path):
+    """ Registra ogni coppia richiesta/risposta nel journal indicato. """
+    global _recorder
+    stop_recording()
+    _recorder = JournalRecorder(path)
+    print(f"🎙️ Registrazione delle richieste API in {path}")
+
+def stop_recording():
+    """ Chiude il journal di registrazione, se attivo. """
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+        _recorder = None
+
+def start_replay(replayer):
+    """ Sostituisce la rete con le risposte registrate fornite da `replayer`. """
+    global _replayer
+    _replayer = replayer
+
+def stop_replay():
+    """ Ripristina le richieste reali verso Bybit. """
+    global _replayer
+    _replayer = None
+
+def _http(method, url, params, headers, timeout):
+    """ Esegue la richiesta HTTP reale verso Bybit. """
+    if method == "GET":
+        return requests.get(url, params=params, headers=headers, timeout=timeout)
+    return requests.post(url, json=params, headers=headers, timeout=timeout)
+
+def _send(method, endpoint, params, headers, timeout, hedge_delay=None):
+    """
+    Invia la richiesta HTTP (o la riproduce dal journal) registrandola se richiesto.
+    Con `hedge_delay` lancia una seconda copia se la prima non risponde in tempo.
+    """
+    if _replayer is not None:
+        return _replayer.respond(method, endpoint, params)
+
+    url = f"{BASE_URL}{endpoint}"
+    started = time.time()
+    try:
+        if hedge_delay is None:
+            response = _http(method, url, params, headers, timeout)
+        else:
+            # La seconda copia è una richiesta reale: parte solo se il budget ha un token libero
+            response = hedged_call(lambda: _http(method, url, params, headers, timeout), hedge_delay,
+                                   admit=lambda: _request_budget.try_acquire())
+    except requests.exceptions.RequestException as e:
+        if _recorder is not None:
+            if isinstance(e, requests.exceptions.Timeout):
+                error = "timeout"
+            elif isinstance(e, requests.exceptions.ConnectionError):
+                error = "connection"
+            else:
+                error = str(e)
+            _recorder.record(method, endpoint, params, started, time.time() - started, error=error)
+        raise
+
+    if _recorder is not None:
+        _recorder.record(method, endpoint, params, started, time.time() - started,
+                         status=response.status_code, body=response.text)
+    return response
+
+def _retry_wait(error_class, attempt, retry_after=None):
+    """ Attende il backoff della classe di errore, tranne dopo l'ultimo tentativo. """
+    if attempt + 1 < MAX_RETRIES:
+        time.sleep(backoff_delay(error_class, attempt, retry_after))
+
+if os.environ.get("MARLA_RECORD"):
+    start_recording(os.environ["MARLA_RECORD"])
+
 # 📌 Funzione per generare firma API v5
 def generate_signature(params, secret):
     """ Genera la firma richiesta per l'autenticazione API di Bybit v5. """
@@ -38,23 +131,46 @@ def make_request(endpoint, params=None, method="GET", requires_auth=False):
         headers["X-BYBIT-API-KEY"] = API_KEY
 
     url = f"{BASE_URL}{endpoint}"
+    timeout = timeout_for(endpoint)
+    breaker = get_breaker(endpoint)
+    latency = get_latency_tracker(endpoint)
+    hedge = is_hedgeable(endpoint, method) and _replayer is None
 
     for attempt in range(MAX_RETRIES):
+        if not breaker.allow():
+            print(f"🔌 Circuito aperto su {endpoint}: exchange degradato, richiesta saltata.")
+            return None
+
+        _request_budget.acquire()  # 🔄 Ogni tentativo, retry compresi, rispetta il budget globale
+
         try:
-            if method == "GET":
-                response = requests.get(url, params=params, headers=headers, timeout=10)
-            else:
-                response = requests.post(url, json=params, headers=headers, timeout=10)
+            started = time.monotonic()
+            hedge_delay = latency.hedge_delay(timeout) if hedge else None
+            response = _send(method, endpoint, params, headers, timeout, hedge_delay=hedge_delay)
 
             if response.status_code == 401:
+                breaker.record_success()  # L'exchange ha risposto: il circuito non c'entra
                 print(f"🚫 Errore 401: API Key non valida o permessi insufficienti su {endpoint}")
                 return None
 
             if response.status_code != 200:
+                error_class = classify_status(response.status_code)
                 print(f"⚠️ Errore API {endpoint}: {response.status_code} - {response.text}")
-                time.sleep(2)
+                if error_class == "server":
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()  # 429 e 4xx: l'exchange ha risposto
+
+                if error_class == "client":
+                    return None  # ❌ Errore della richiesta: riprovare non serve
+
+                retry_after = getattr(response, "headers", {}).get("Retry-After")
+                _retry_wait(error_class, attempt, retry_after)
                 continue  # Riprova la richiesta
 
+            breaker.record_success()
+            latency.observe(time.monotonic() - started)
+
             data = response.json()
             if "retCode" in data and data["retCode"] != 0:
                 print(f"⚠️ Errore API Bybit: {data['retMsg']}")
@@ -64,11 +180,19 @@ def make_request(endpoint, params=None, method="GET", requires_auth=False):
 
         except requests.exceptions.Timeout:
             print(f"⏳ Timeout nella richiesta a {url}, tentativo {attempt + 1} di {MAX_RETRIES}")
+            breaker.record_failure()
+            _retry_wait("timeout", attempt)
         except requests.exceptions.ConnectionError:
             print(f"🚫 Errore di connessione a {url}, tentativo {attempt + 1} di {MAX_RETRIES}")
+            breaker.record_failure()
+            _retry_wait("connection", attempt)
         except requests.exceptions.RequestException as e:
             print(f"❌ Errore generico: {e}")
+            breaker.record_failure()
             return None
+        except Exception:
+            breaker.record_failure()  # ✅ Ogni uscita chiude l'eventuale richiesta di prova
+            raise
 
     print(f"❌ Errore API non risolto dopo {MAX_RETRIES} tentativi. Skipping request.")
     return None
@@ -90,9 +214,9 @@ def get_balance():
     print("⚠️ Errore: Impossibile ottenere il saldo. Controlla le API Key e i permessi.")
     return 0.0
 
-# 📌 Recupera le coppie future disponibili su Bybit
-def get_filtered_pairs():
-    """ Recupera tutte le coppie future disponibili e le filtra per volume alto. """
+# 📌 Recupera i ticker delle coppie future ad alto volume
+def get_filtered_tickers():
+    """ Recupera i ticker di tutte le coppie future e li filtra per volume alto. """
     endpoint = "/v5/market/tickers"
     params = {"category": "linear"}
 
@@ -104,27 +228,45 @@ def get_filtered_pairs():
 
     print(f"🔍 Debug API Bybit (Prime 5 coppie): {response['result']['list'][:5]}")
 
-    pairs = []
+    tickers = []
     for item in response["result"]["list"]:
         try:
             volume = float(item.get("turnover24h", item.get("volume24h", 0)))  
-            if volume > 1000000:  
-                pairs.append(item["symbol"])
+            if volume > 1000000 and item["symbol"]:
+                tickers.append(item)
         except KeyError as e:
             print(f"⚠️ Errore: Chiave mancante nella risposta API {e}")
 
+    return tickers
+
+# 📌 Recupera le coppie future disponibili su Bybit
+def get_filtered_pairs():
+    """ Recupera tutte le coppie future disponibili e le filtra per volume alto. """
+    pairs = [ticker["symbol"] for ticker in get_filtered_tickers()]
+
     print(f"✅ Coppie selezionate dopo il filtro: {pairs}")
     return pairs
 
-# 📌 Recupera dati storici per un simbolo
-def get_historical_data(symbol, timeframe="5"):
-    """ Recupera i dati storici di un simbolo per il trading e l'AI. """
+# 📌 Aggiorna il ring buffer delle candele di un simbolo
+def get_candles(symbol, timeframe="5"):
+    """
+    Aggiorna e restituisce il CandleBuffer del simbolo. Se il buffer è già popolato
+    vengono scaricate solo le candele mancanti invece dell'intero storico.
+    """
+    buffer = candle_store.get(symbol, timeframe)
+    limit = buffer.capacity
+
+    if buffer.last_open_time is not None:
+        period_ms = TIMEFRAME_SECONDS[timeframe] * 1000
+        missing = (int(time.time() * 1000) - buffer.last_open_time) // period_ms
+        limit = int(min(buffer.capacity, max(2, missing + 1)))
+
     endpoint = "/v5/market/kline"
     params = {
         "symbol": symbol,
         "interval": timeframe,
         "category": "linear",
-        "limit": 200  
+        "limit": limit
     }
 
     response = make_request(endpoint, params)
@@ -135,16 +277,22 @@ def get_historical_data(symbol, timeframe="5"):
 
     print(f"🔍 Debug API Bybit {symbol}: {response['result']['list'][:3]}")
 
-    df = pd.DataFrame(response["result"]["list"], columns=[
-        "open_time", "open", "high", "low", "close", "volume", "turnover"
-    ])
+    buffer.update_from_kline(response["result"]["list"])
+
+    journal = get_journal()
+    if journal is not None:
+        journal.put("candle", (symbol, timeframe), buffer.latest())
 
-    df["open_time"] = pd.to_datetime(df["open_time"].astype(float), unit="ms")
-    df[["open", "high", "low", "close", "volume", "turnover"]] = df[[
-        "open", "high", "low", "close", "volume", "turnover"
-    ]].astype(float)
+    return buffer
+
+# 📌 Recupera dati storici per un simbolo
+def get_historical_data(symbol, timeframe="5"):
+    """ Recupera i dati storici di un simbolo per il trading e l'AI (dalla candela più vecchia). """
+    buffer = get_candles(symbol, timeframe)
+    if buffer is None or not len(buffer):
+        return None
 
-    return df
+    return buffer.to_dataframe()
 
 # 📌 Recupera dati live di una coppia
 def get_live_data(symbol):
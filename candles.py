@@ -0,0 +1,185 @@
+import threading
+import numpy as np
+import pandas as pd
+from scheduler import TIMEFRAME_SECONDS
+
+CANDLE_CAPACITY = 200  # Numero massimo di candele mantenute per simbolo e timeframe
+PRICE_FIELDS = ("open", "high", "low", "close", "volume", "turnover")
+
+class CandleBuffer:
+    """
+    Ring buffer a capacità fissa su array NumPy contigui (int64 per i tempi, float64 per i prezzi).
+    Ogni valore viene scritto due volte (posizione i e i + capacità): in questo modo le ultime
+    N candele sono sempre una slice contigua e possono essere esposte come viste senza copia.
+    Le candele sono ordinate dalla più vecchia alla più recente.
+    """
+
+    def __init__(self, capacity=CANDLE_CAPACITY):
+        self.capacity = capacity
+        self._times = np.zeros(2 * capacity, dtype=np.int64)
+        self._data = np.zeros((len(PRICE_FIELDS), 2 * capacity), dtype=np.float64)
+        self._head = 0  # Prossima posizione di scrittura in [0, capacità)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def last_open_time(self):
+        """Open time (ms) dell'ultima candela, oppure None se il buffer è vuoto."""
+        if not self._size:
+            return None
+        return int(self._times[(self._head - 1) % self.capacity])
+
+    def _write(self, positions, times, values):
+        self._times[positions] = times
+        self._times[positions + self.capacity] = times
+        self._data[:, positions] = values
+        self._data[:, positions + self.capacity] = values
+
+    def append(self, times, values):
+        """Aggiunge candele in ordine cronologico. `values` ha forma (campi, n)."""
+        count = len(times)
+        if count > self.capacity:
+            times, values = times[-self.capacity:], values[:, -self.capacity:]
+            count = self.capacity
+        if not count:
+            return
+
+        positions = (self._head + np.arange(count)) % self.capacity
+        self._write(positions, times, values)
+        self._head = (self._head + count) % self.capacity
+        self._size = min(self._size + count, self.capacity)
+
+    def update_from_kline(self, rows):
+        """
+        Decodifica la risposta kline di Bybit (lista di stringhe, dalla più recente) direttamente
+        nel buffer. La candela ancora aperta viene sovrascritta, quelle nuove vengono accodate.
+        """
+        if not rows:
+            return 0
+
+        raw = np.asarray([row[:len(PRICE_FIELDS) + 1] for row in rows], dtype=np.float64)
+        if raw[0, 0] > raw[-1, 0]:
+            raw = raw[::-1]
+
+        times = raw[:, 0].astype(np.int64)
+        values = raw[:, 1:].T
+
+        last = self.last_open_time
+        if last is not None:
+            current = np.flatnonzero(times == last)
+            if current.size:
+                position = np.array([(self._head - 1) % self.capacity])
+                self._write(position, times[current[-1:]], values[:, current[-1:]])
+
+            newer = times > last
+            times, values = times[newer], values[:, newer]
+
+        self.append(times, values)
+        return len(times)
+
+    def _window(self, count=None):
+        size = self._size if count is None else min(count, self._size)
+        start = (self._head - size) % self.capacity
+        return start, start + size
+
+    @staticmethod
+    def _readonly(array):
+        view = array.view()
+        view.flags.writeable = False
+        return view
+
+    def times(self, count=None):
+        """Vista in sola lettura sugli open time (ms) delle ultime `count` candele."""
+        start, end = self._window(count)
+        return self._readonly(self._times[start:end])
+
+    def view(self, field, count=None):
+        """Vista in sola lettura, senza copia, su un campo (es. "close") delle ultime `count` candele."""
+        start, end = self._window(count)
+        return self._readonly(self._data[PRICE_FIELDS.index(field), start:end])
+
+    def latest(self):
+        """Restituisce l'ultima candela come dizionario, oppure None se il buffer è vuoto."""
+        if not self._size:
+            return None
+        position = (self._head - 1) % self.capacity
+        candle = {"open_time": int(self._times[position])}
+        for index, field in enumerate(PRICE_FIELDS):
+            candle[field] = float(self._data[index, position])
+        return candle
+
+    def to_dataframe(self):
+        """
+        Adattatore di compatibilità: DataFrame scrivibile con le stesse colonne di get_historical_data.
+        I dati sono copiati, quindi il frame non cambia quando il buffer viene aggiornato;
+        per l'accesso senza copia usare view().
+        """
+        columns = {"open_time": pd.to_datetime(self.times(), unit="ms")}
+        for field in PRICE_FIELDS:
+            columns[field] = self.view(field)
+        return pd.DataFrame(columns, copy=True)
+
+    def snapshot(self):
+        """Copia compatta del contenuto del buffer, per il journal di stato."""
+        start, end = self._window()
+        return {"times": self._times[start:end].copy(), "values": self._data[:, start:end].copy()}
+
+    def restore(self, snapshot):
+        """Ripristina il contenuto salvato con snapshot()."""
+        self._head = 0
+        self._size = 0
+        self.append(snapshot["times"], snapshot["values"])
+
+    def nbytes(self):
+        """Memoria occupata dagli array del buffer, in byte."""
+        return self._times.nbytes + self._data.nbytes
+
+class CandleStore:
+    """Raccolta thread-safe di CandleBuffer indicizzati per (simbolo, timeframe)."""
+
+    def __init__(self, capacity=CANDLE_CAPACITY):
+        self.capacity = capacity
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def get(self, symbol, timeframe):
+        """Restituisce il buffer del simbolo/timeframe, creandolo se non esiste."""
+        key = (symbol, timeframe)
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                buffer = self._buffers[key] = CandleBuffer(self.capacity)
+            return buffer
+
+    def items(self):
+        with self._lock:
+            return list(self._buffers.items())
+
+    def snapshot(self):
+        """Snapshot di tutti i buffer, indicizzati per (simbolo, timeframe)."""
+        return {key: buffer.snapshot() for key, buffer in self.items() if len(buffer)}
+
+    def restore(self, snapshots, latest=None):
+        """
+        Ripristina i buffer dagli snapshot e vi aggiunge l'ultima candela registrata,
+        solo se contigua: in caso di buco le candele mancanti verranno riscaricate.
+        """
+        latest = latest or {}
+        for key, snapshot in snapshots.items():
+            buffer = self.get(*key)
+            buffer.restore(snapshot)
+
+            candle = latest.get(key)
+            if candle is None or buffer.last_open_time is None:
+                continue
+            period_ms = TIMEFRAME_SECONDS[key[1]] * 1000
+            if candle["open_time"] - buffer.last_open_time <= period_ms:
+                buffer.update_from_kline([[candle["open_time"]] + [candle[field] for field in PRICE_FIELDS]])
+
+    def nbytes(self):
+        """Memoria totale occupata da tutti i buffer, in byte."""
+        return sum(buffer.nbytes() for _, buffer in self.items())
+
+candle_store = CandleStore()
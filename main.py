@@ -2,20 +2,48 @@ import joblib
 import numpy as np
 import time
 from concurrent.futures import ThreadPoolExecutor
-from api import get_live_data, get_filtered_pairs, get_open_trades
-from orders import place_order
+from api import get_live_data, get_filtered_tickers, get_request_budget
+from candles import candle_store
+from orders import MAX_OPEN_TRADES, count_open_trades, place_order, restore_trading_state
+from scheduler import CandleScheduler
+from shard import get_trade_gate
+from state_journal import STATE_JOURNAL_PATH, get_journal, open_journal
 
 # ✅ Caricamento AI e scaler
 model = joblib.load("ai_model.pkl")
 scaler = joblib.load("scaler.pkl")
 
-MAX_OPEN_TRADES = 10  # 🔥 Limite massimo di trade aperti contemporaneamente
-CHECK_INTERVAL = 60  # 🔄 Controlla il mercato ogni 60 secondi
+CHECK_INTERVAL = 60  # 🔄 Aggiorna l'elenco delle coppie ogni 60 secondi
+SCAN_TIMEFRAME = "1"  # ⏱️ Ogni coppia viene analizzata alla chiusura della candela di questo timeframe
+AI_THRESHOLD = 0.6  # Probabilità minima per confermare un segnale
+API_CALLS_PER_DECISION = 2  # Richieste API consumate da make_trade_decision
+
+LIMIT_RETRY_DELAY = 10  # Secondi dopo cui una coppia saltata per limite di trade torna in coda
+
+scheduler = CandleScheduler(budget=get_request_budget(), default_timeframe=SCAN_TIMEFRAME,
+                            cost_per_symbol=API_CALLS_PER_DECISION)
+
+def restore_state(path=STATE_JOURNAL_PATH):
+    """
+    Apre il journal di stato e ripristina trade, candele e priorità salvati prima del riavvio,
+    poi scrive subito uno snapshot: anche un processo riavviato spesso conserva il proprio stato.
+    """
+    started = time.time()
+    journal = open_journal(path)
+
+    restore_trading_state(journal)
+    for symbol, proximity in journal.items("signal_proximity").items():
+        scheduler.record_signal_proximity(symbol, proximity)
+
+    journal.register_snapshot("signal_proximity", scheduler.signal_proximities)
+    journal.compact()
+    print(f"♻️ Stato ripristinato in {time.time() - started:.2f}s ({len(candle_store.items())} serie di candele)")
+    return journal
 
 def make_trade_decision(symbol):
     """Analizza i dati live e decide se aprire un trade."""
     # 🔥 Controlla il numero di trade aperti PRIMA di continuare
-    open_trades = get_open_trades()
+    open_trades = count_open_trades()
     if open_trades >= MAX_OPEN_TRADES:
         print(f"⚠️ Limite massimo di {MAX_OPEN_TRADES} trade aperti raggiunto. Skipping {symbol}.")
         return
@@ -32,49 +60,79 @@ def make_trade_decision(symbol):
         # ✅ Predizione AI e probabilità
         prob = model.predict_proba(X_live_scaled)[:, 1][0]  # 🔥 FIX: Preleva singolo valore
         signal = model.predict(X_live_scaled)[0]
+        scheduler.record_signal_proximity(symbol, prob / AI_THRESHOLD)
 
-        if prob < 0.6:
+        if prob < AI_THRESHOLD:
             print(f"⚠️ AI insicura ({prob:.2f}), nessun trade per {symbol}.")
             return
 
+        # ✅ La prenotazione è atomica: più thread non possono superare insieme il limite
+        trade_gate = get_trade_gate()
+        if not trade_gate.reserve_trade_slot(symbol):
+            print(f"⚠️ Limite globale di trade aperti raggiunto. Skipping {symbol}.")
+            return
+
         print(f"✅ AI conferma il segnale ({prob:.2f}), eseguo ordine per {symbol}!")
-        place_order(symbol, "BUY" if signal == 1 else "SELL", 100, data["close"])
+        response = None
+        try:
+            response = place_order(symbol, "BUY" if signal == 1 else "SELL", 100, data["close"])
+        finally:
+            if not response:
+                trade_gate.release_trade_slot(symbol)
 
     except Exception as e:
         print(f"❌ Errore nell'analisi AI per {symbol}: {e}")
 
-def scan_and_trade():
-    """Scansiona le coppie di trading disponibili e prende decisioni di trading."""
-    while True:
-        print("🔍 Scansione delle coppie disponibili...")
-        pairs = get_filtered_pairs()
-
-        if not pairs:
-            print("⚠️ Nessuna coppia trovata. Attendo il prossimo ciclo...")
-            time.sleep(CHECK_INTERVAL)
-            continue
-
-        open_trades = get_open_trades()  # ✅ Verifica il numero di trade aperti
-        print(f"📊 Trade attualmente aperti: {open_trades}/{MAX_OPEN_TRADES}")
-
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = []
-
-            for symbol in pairs:
-                if open_trades >= MAX_OPEN_TRADES:
-                    print(f"⚠️ Limite raggiunto. Stop trading per ora.")
-                    break
-
-                futures.append(executor.submit(make_trade_decision, symbol))
-                open_trades += 1  # ✅ Aggiorna il conteggio in memoria
-                time.sleep(1)  # 🔄 Ritardo per evitare limiti API
-
-            for future in futures:
-                future.result()  # ✅ Attende il completamento di tutti i thread
-
-        print(f"⏳ Attesa {CHECK_INTERVAL} secondi prima della prossima scansione...")
-        time.sleep(CHECK_INTERVAL)
+def scan_and_trade(fetch_tickers=get_filtered_tickers):
+    """
+    Analizza le coppie alla chiusura delle candele, in ordine di priorità e nel rispetto del budget API.
+    `fetch_tickers` restituisce l'universo da analizzare (in modalità shard solo la partizione del worker).
+    """
+    last_refresh = 0
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        while True:
+            if time.time() - last_refresh >= CHECK_INTERVAL:
+                print("🔍 Scansione delle coppie disponibili...")
+                tickers = fetch_tickers()
+                last_refresh = time.time()
+
+                if tickers:
+                    scheduler.update_universe(tickers)
+                    print(f"✅ {len(scheduler)} coppie pianificate sul timeframe {SCAN_TIMEFRAME}")
+                elif not len(scheduler):
+                    print("⚠️ Nessuna coppia trovata. Attendo il prossimo ciclo...")
+                    time.sleep(CHECK_INTERVAL)
+                    continue
+
+            batch = scheduler.next_batch()
+
+            if batch:
+                open_trades = count_open_trades()  # ✅ Verifica il numero di trade aperti
+                print(f"📊 Trade attualmente aperti: {open_trades}/{MAX_OPEN_TRADES} - {len(batch)} coppie pronte")
+
+                futures = []
+                for index, symbol in enumerate(batch):
+                    if open_trades >= MAX_OPEN_TRADES:
+                        print(f"⚠️ Limite raggiunto. Stop trading per ora.")
+                        scheduler.defer(batch[index:], delay=LIMIT_RETRY_DELAY)  # ✅ Rinviate, non perse
+                        break
+
+                    futures.append(executor.submit(make_trade_decision, symbol))
+                    open_trades += 1  # ✅ Aggiorna il conteggio in memoria
+
+                for future in futures:
+                    future.result()  # ✅ Attende il completamento di tutti i thread
+
+            journal = get_journal()
+            if journal is not None:
+                journal.checkpoint()  # 🗜️ Compattazione periodica del journal di stato
+
+            wait = scheduler.seconds_until_next()
+            wait = CHECK_INTERVAL if wait is None else min(wait, CHECK_INTERVAL)
+            time.sleep(wait)
 
 if __name__ == "__main__":
     print("🚀 Bot avviato! Inizio scansione delle coppie future...")
+    restore_state()
     scan_and_trade()
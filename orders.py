@@ -1,8 +1,12 @@
 import time
 import logging
 from concurrent.futures import ThreadPoolExecutor
-from api import get_filtered_pairs, get_balance, make_request, get_historical_data
-from strategy import calculate_trade_levels
+from api import get_filtered_pairs, make_request, get_candles
+from candles import candle_store
+from strategy import analyze_indicators, calculate_trade_levels
+from signals import NO_SIGNAL, SIGNAL_FEATURES, generate_signals_from_vectors
+from shard import get_trade_gate
+from state_journal import get_journal, open_journal
 
 # Configurazione del logging
 logging.basicConfig(filename="trading_log.txt", level=logging.INFO, format="%(asctime)s - %(message)s")
@@ -10,26 +14,133 @@ logging.basicConfig(filename="trading_log.txt", level=logging.INFO, format="%(as
 MAX_WORKERS = 5  # Numero massimo di processi paralleli
 MAX_OPEN_TRADES = 10  # Limite massimo di trade aperti contemporaneamente
 SCAN_INTERVAL = 60  # Intervallo tra le scansioni in secondi (es. ogni 60 sec)
+STATE_JOURNAL_PATH = "marla_orders_state.journal"  # Journal di stato di scan_and_trade_parallel (distinto da quello di main.py)
 
 open_trades = {}  # Dizionario per tracciare gli ordini attivi
+pending_orders = {}  # Ordini inviati di cui non conosciamo ancora l'esito (ripristinati dopo un crash)
+trade_opened_at = {}  # Istante di apertura di ogni trade, per non scartare quelli appena aperti
+RECONCILE_GRACE = 10  # Secondi concessi all'exchange per mostrare una posizione appena aperta
 
 from api import make_request
 
-def get_open_trades():
-    """Ottiene le posizioni aperte per determinare se possiamo aprire nuovi trade."""
+def fetch_open_positions():
+    """
+    Simboli con posizione aperta sull'exchange, oppure None se la richiesta fallisce.
+    A differenza di get_open_trades distingue un errore da "nessuna posizione".
+    """
     endpoint = "/v5/position/list"
     params = {"category": "linear"}  # ✅ Assicurati che la categoria sia impostata correttamente
     response = make_request(endpoint, params)
 
     if response and "result" in response and "list" in response["result"]:
         positions = response["result"]["list"]
-        open_trades = [pos["symbol"] for pos in positions if float(pos["size"]) > 0]
+        return [pos["symbol"] for pos in positions if float(pos["size"]) > 0]
+
+    return None
+
+def get_open_trades():
+    """Ottiene le posizioni aperte per determinare se possiamo aprire nuovi trade."""
+    open_trades = reconcile_open_trades()
+
+    if open_trades is not None:
         print(f"📌 Posizioni aperte: {open_trades}")
         return open_trades
 
     print("⚠️ Nessuna posizione aperta trovata o errore nella richiesta API.")
     return []
 
+def forget_closed_trades(exchange_symbols, as_of=None):
+    """
+    Rimuove dal registro locale (e dal journal di stato) i trade non più aperti sull'exchange
+    e chiude gli ordini in sospeso ripristinati dopo un crash: quelli che l'exchange mostra
+    eseguiti diventano trade aperti, gli altri vengono scartati.
+    `as_of` è l'istante in cui l'elenco dell'exchange è stato letto.
+    """
+    as_of = time.time() if as_of is None else as_of
+    open_symbols = set(exchange_symbols)
+    journal = get_journal()
+
+    for symbol in set(open_trades) - open_symbols:
+        if trade_opened_at.get(symbol, 0) >= as_of - RECONCILE_GRACE:
+            continue  # Appena aperto: l'exchange potrebbe non mostrarlo ancora
+        open_trades.pop(symbol, None)
+        trade_opened_at.pop(symbol, None)
+        if journal is not None:
+            journal.delete("position", symbol)
+
+    for symbol, params in list(pending_orders.items()):
+        if symbol in open_symbols and symbol not in open_trades:
+            # ✅ Eseguito prima del crash ma mai registrato: diventa un trade aperto (ID ordine sconosciuto)
+            print(f"✅ Ordine in sospeso su {symbol} risulta eseguito sull'exchange, registrato come trade aperto.")
+            open_trades[symbol] = None
+            trade_opened_at[symbol] = as_of
+            if journal is not None:
+                journal.put("position", symbol, {"order_id": None, "side": params.get("side"), "qty": params.get("qty"),
+                                                 "entry_price": None, "opened_at": as_of,
+                                                 "tp1": params.get("takeProfit"), "sl": params.get("stopLoss"),
+                                                 "trailing_stop": params.get("trailingStop")})
+        pending_orders.pop(symbol, None)
+        if journal is not None:
+            journal.delete("pending_order", symbol)
+
+def reconcile_open_trades(positions=None, as_of=None):
+    """
+    Allinea trade e ordini in sospeso registrati con le posizioni dell'exchange.
+    Senza `positions` le legge via REST. Restituisce i simboli aperti, oppure None in caso di errore.
+    """
+    if positions is None:
+        as_of = time.time()
+        positions = fetch_open_positions()
+        if positions is None:
+            return None
+
+    forget_closed_trades(positions, as_of)
+    return positions
+
+def count_open_trades():
+    """
+    Trade aperti o prenotati secondo il coordinatore: quello condiviso in modalità shard,
+    uno locale altrimenti (vedi shard.get_trade_gate), così il limite è applicato allo stesso modo.
+    Le posizioni lette servono anche a ripulire il journal di stato di questo processo.
+    """
+    positions, as_of, count = get_trade_gate().position_state()
+    if as_of:
+        reconcile_open_trades(positions, as_of)
+    return count
+
+def restore_open_trades(journal):
+    """
+    Ripristina trade aperti e ordini in sospeso dal journal di stato dopo un riavvio.
+    """
+    for symbol, position in journal.items("position").items():
+        open_trades[symbol] = position["order_id"]
+        trade_opened_at[symbol] = position.get("opened_at", 0)
+    pending_orders.update(journal.items("pending_order"))
+
+    if pending_orders:
+        print(f"⚠️ Ordini con esito sconosciuto prima del riavvio: {list(pending_orders)}")
+    print(f"♻️ Ripristinati {len(open_trades)} trade aperti dal journal di stato")
+
+def restore_trading_state(journal):
+    """
+    Ripristina dal journal trade aperti, ordini in sospeso e candele, e registra lo snapshot delle candele.
+    Gli indicatori non hanno uno stato proprio: vengono ricalcolati dalle candele ripristinate,
+    a cui get_candles aggiunge solo quelle mancanti.
+    """
+    restore_open_trades(journal)
+    count_open_trades()  # ✅ Scarta subito trade chiusi e ordini in sospeso già verificati
+    candle_store.restore(journal.items("candles"), journal.items("candle"))
+    journal.register_snapshot("candles", candle_store.snapshot)
+
+def restore_state(path=STATE_JOURNAL_PATH):
+    """Apre il journal di stato di questo processo, ripristina lo stato salvato e ne scrive subito uno snapshot."""
+    started = time.time()
+    journal = open_journal(path)
+    restore_trading_state(journal)
+    journal.compact()
+    print(f"♻️ Stato ripristinato in {time.time() - started:.2f}s ({len(candle_store.items())} serie di candele)")
+    return journal
+
 def place_order(symbol, side, qty, entry_price):
     """
     Esegue un ordine con TP, SL e trailing stop e lo registra nei trade aperti.
@@ -52,12 +163,21 @@ def place_order(symbol, side, qty, entry_price):
         "timeInForce": "GoodTillCancel"
     }
 
+    journal = get_journal()
+    if journal is not None:
+        journal.put("pending_order", symbol, params)  # Registrato prima dell'invio: sopravvive a un crash
+
     response = make_request("/v5/order/create", params, method="POST")
 
     if response:
         order_id = response.get("result", {}).get("orderId", None)
         if order_id:
             open_trades[symbol] = order_id  # Registra l'ordine attivo
+            trade_opened_at[symbol] = time.time()
+            if journal is not None:
+                journal.put("position", symbol, {"order_id": order_id, "side": side, "qty": qty,
+                                                 "entry_price": entry_price, "opened_at": trade_opened_at[symbol],
+                                                 **trade_levels})
             print(f"✅ Ordine {side} aperto su {symbol}: QTY {qty}, TP1 {trade_levels['tp1']}, TP2 {trade_levels['tp2']}, TP3 {trade_levels['tp3']}, SL {trade_levels['sl']}, Trailing Stop {trade_levels['trailing_stop']}")
             logging.info(f"Ordine aperto: {symbol} {side} QTY: {qty}, TP1: {trade_levels['tp1']}, TP2: {trade_levels['tp2']}, TP3: {trade_levels['tp3']}, SL: {trade_levels['sl']}, Trailing Stop: {trade_levels['trailing_stop']}")
         else:
@@ -65,6 +185,9 @@ def place_order(symbol, side, qty, entry_price):
     else:
         print(f"❌ Errore nell'apertura dell'ordine per {symbol}")
 
+    if journal is not None:
+        journal.delete("pending_order", symbol)  # Solo dopo aver registrato la posizione
+
     return response
 
 def move_stop_loss(symbol, order_id, new_sl):
@@ -88,41 +211,66 @@ def move_stop_loss(symbol, order_id, new_sl):
     
     return response
 
-def scan_and_trade(symbol):
+def load_indicators(symbol):
+    """
+    Scarica lo storico di una coppia e calcola gli indicatori usati dalle regole dei segnali.
+    Restituisce (df, vettore delle feature dei segnali), oppure None se mancano i dati.
+    """
+    buffer = get_candles(symbol)
+    if buffer is None or not len(buffer):
+        print(f"⚠️ Nessun dato storico per {symbol}. Skipping...")
+        return None
+    return analyze_indicators(buffer.to_dataframe(), buffer, features=SIGNAL_FEATURES)
+
+def scan_and_trade(symbol, side=None, df=None):
     """
     Scansiona una singola coppia e apre un trade se soddisfa i criteri.
+    Con `side` e `df` già calcolati (vedi scan_and_trade_parallel) non riscarica lo storico.
     """
     print(f"📡 Analizzando {symbol}...")
 
     # Controlla quanti trade sono aperti prima di procedere
-    current_open_trades = get_open_trades()
-    if current_open_trades >= MAX_OPEN_TRADES:
+    if count_open_trades() >= MAX_OPEN_TRADES:
         print(f"⚠️ Limite massimo di {MAX_OPEN_TRADES} trade aperti raggiunto, skipping {symbol}...")
         return
 
-    df = get_historical_data(symbol)
-
     if df is None:
-        print(f"⚠️ Nessun dato storico per {symbol}. Skipping...")
-        return
+        loaded = load_indicators(symbol)
+        if loaded is None:
+            return
+        df, _ = loaded
 
     entry_price = df["close"].iloc[-1]
-    side = "Buy" if df["RSI"].iloc[-1] > 55 else "Sell"
+    if side is None:
+        side = "Buy" if df["RSI"].iloc[-1] > 55 else "Sell"
 
     trade_levels = calculate_trade_levels(entry_price, side)
     if trade_levels is None:
         print(f"⏭️ Nessun setup valido per {symbol}. Skipping...")
         return
 
-    balance = get_balance()
-    risk_per_trade = 0.02  # 2% del capitale per trade
-    position_size = balance * risk_per_trade / entry_price
+    # ✅ Limite e saldo vengono dal coordinatore: la prenotazione è atomica tra thread e processi
+    trade_gate = get_trade_gate()
+    if not trade_gate.reserve_trade_slot(symbol):
+        print(f"⚠️ Limite globale di trade aperti raggiunto, skipping {symbol}...")
+        return
+
+    response = None
+    try:
+        balance = trade_gate.get_balance()
+        risk_per_trade = 0.02  # 2% del capitale per trade
+        position_size = balance * risk_per_trade / entry_price
 
-    place_order(symbol, side, position_size, entry_price)
+        response = place_order(symbol, side, position_size, entry_price)
+    finally:
+        if not response:
+            trade_gate.release_trade_slot(symbol)
 
 def scan_and_trade_parallel():
     """
     Mantiene il bot attivo in un ciclo infinito, scansionando periodicamente le coppie.
+    Gli indicatori vengono calcolati in parallelo, i segnali per tutte le coppie in un'unica
+    valutazione vettoriale; solo le coppie con segnale passano all'apertura del trade.
     """
     while True:
         pairs = get_filtered_pairs()
@@ -133,7 +281,25 @@ def scan_and_trade_parallel():
             print(f"🔍 Scansione di {len(pairs)} coppie in parallelo...")
 
             with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-                executor.map(scan_and_trade, pairs)
+                loaded = {
+                    symbol: result for symbol, result in zip(pairs, executor.map(load_indicators, pairs))
+                    if result is not None
+                }
+                frames = {symbol: df for symbol, (df, _) in loaded.items()}
+                signals = generate_signals_from_vectors({symbol: vector for symbol, (_, vector) in loaded.items()})
+                candidates = [symbol for symbol, signal in signals.items() if signal != NO_SIGNAL]
+                print(f"📈 Segnali attivi su {len(candidates)}/{len(frames)} coppie: {candidates}")
+
+                executor.map(lambda symbol: scan_and_trade(symbol, signals[symbol], frames[symbol]), candidates)
+
+        journal = get_journal()
+        if journal is not None:
+            journal.checkpoint()  # 🗜️ Compattazione periodica del journal di stato
 
         print(f"⏳ Attesa {SCAN_INTERVAL} secondi prima della prossima scansione...")
         time.sleep(SCAN_INTERVAL)  # Attesa tra una scansione e l'altra
+
+if __name__ == "__main__":
+    print("🚀 Scanner avviato! Inizio scansione parallela delle coppie...")
+    restore_state()
+    scan_and_trade_parallel()
@@ -0,0 +1,244 @@
+import argparse
+import cProfile
+import json
+import pstats
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import defaultdict, deque
+import requests
+
+JOURNAL_MAGIC = b"MARLAJ1\n"
+RECORD_HEADER = struct.Struct("<I")  # Lunghezza del record compresso
+SECRET_PARAMS = {"apiKey", "sign"}  # Mai scritti nel journal
+VOLATILE_PARAMS = {"apiKey", "sign", "timestamp", "limit"}  # Ignorati nel confronto in replay
+REPLAY_SEED = 0  # Seme del jitter di backoff durante il replay
+
+class ReplayExhausted(Exception):
+    """Sollevata quando il journal non contiene più risposte per una richiesta."""
+
+# 📌 Scrittura del journal
+class JournalRecorder:
+    """Scrive ogni coppia richiesta/risposta in un journal append-only di record zlib+JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(JOURNAL_MAGIC)
+            self._file.flush()
+
+    def record(self, method, endpoint, params, started, elapsed, status=None, body=None, error=None):
+        entry = {
+            "t": started,
+            "elapsed": round(elapsed, 6),
+            "method": method,
+            "endpoint": endpoint,
+            "params": {key: value for key, value in params.items() if key not in SECRET_PARAMS},
+            "status": status,
+            "body": body,
+            "error": error,
+        }
+        payload = zlib.compress(json.dumps(entry, separators=(",", ":")).encode("utf-8"))
+        with self._lock:
+            self._file.write(RECORD_HEADER.pack(len(payload)) + payload)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def read_journal(path):
+    """Legge tutti i record di un journal in ordine di scrittura."""
+    records = []
+    with open(path, "rb") as journal:
+        if journal.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            raise ValueError(f"{path} non è un journal valido")
+        while True:
+            header = journal.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            (length,) = RECORD_HEADER.unpack(header)
+            payload = journal.read(length)
+            if len(payload) < length:
+                break  # Record troncato da un crash: lo ignora
+            records.append(json.loads(zlib.decompress(payload)))
+    return records
+
+def request_key(method, endpoint, params):
+    """Chiave di confronto di una richiesta, indipendente da firma, timestamp e limit."""
+    stable = {key: value for key, value in params.items() if key not in VOLATILE_PARAMS}
+    return method, endpoint, json.dumps(stable, sort_keys=True, default=str)
+
+# 📌 Riproduzione del journal
+class ReplayResponse:
+    """Risposta registrata con la stessa interfaccia minima di requests.Response."""
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text or ""
+
+    def json(self):
+        return json.loads(self.text)
+
+class JournalReplayer:
+    """
+    Restituisce le risposte registrate per ogni richiesta, in ordine FIFO per chiave.
+    Con `realtime=True` attende anche la latenza registrata di ogni risposta.
+    """
+
+    def __init__(self, records, realtime=False):
+        self.realtime = realtime
+        self.start_time = records[0]["t"] if records else time.time()
+        self.served = 0
+        self._lock = threading.Lock()
+        self._queues = defaultdict(deque)
+        for entry in records:
+            self._queues[request_key(entry["method"], entry["endpoint"], entry["params"])].append(entry)
+
+    def respond(self, method, endpoint, params):
+        key = request_key(method, endpoint, params)
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                raise ReplayExhausted(f"Nessuna risposta registrata per {method} {endpoint} {key[2]}")
+            entry = queue.popleft()
+            self.served += 1
+
+        if self.realtime:
+            time.sleep(entry["elapsed"])
+
+        if entry["error"] == "timeout":
+            raise requests.exceptions.Timeout(f"Timeout registrato su {endpoint}")
+        if entry["error"] == "connection":
+            raise requests.exceptions.ConnectionError(f"Errore di connessione registrato su {endpoint}")
+        if entry["error"]:
+            raise requests.exceptions.RequestException(entry["error"])
+
+        return ReplayResponse(entry["status"], entry["body"])
+
+class VirtualClock:
+    """Orologio simulato: le attese avanzano il tempo senza bloccare, per un replay il più veloce possibile."""
+
+    def __init__(self, start):
+        self._now = start
+        self._lock = threading.Lock()
+        self._originals = None
+
+    def time(self):
+        with self._lock:
+            return self._now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self._now += max(seconds, 0)
+
+    def __enter__(self):
+        self._originals = (time.time, time.monotonic, time.sleep)
+        time.time, time.monotonic, time.sleep = self.time, self.time, self.sleep
+        return self
+
+    def __exit__(self, *exc):
+        time.time, time.monotonic, time.sleep = self._originals
+
+# 📌 Profiling di tutti i thread
+class ThreadProfiler:
+    """Profila il thread principale e i thread dei worker con cProfile."""
+
+    def __init__(self):
+        self.profiles = [cProfile.Profile()]
+        self._lock = threading.Lock()
+
+    def _bootstrap(self, frame, event, arg):
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def __enter__(self):
+        # Da Python 3.12 cProfile usa sys.monitoring e vede già tutti i thread
+        if sys.version_info < (3, 12):
+            threading.setprofile(self._bootstrap)
+        self.profiles[0].enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiles[0].disable()
+        threading.setprofile(None)
+
+    def stats(self):
+        with self._lock:
+            return pstats.Stats(*self.profiles)
+
+def _reset_clock_state(api):
+    """
+    Riallinea allo stesso orologio lo stato di processo basato su time.monotonic (budget API,
+    circuit breaker, latenze): va chiamato dopo ogni cambio tra orologio reale e VirtualClock,
+    altrimenti gli istanti di un orologio restano confrontati con quelli dell'altro.
+    """
+    import resilience
+    from scheduler import ApiBudget
+
+    resilience.reset_state()
+    budget = api.get_request_budget()
+    if isinstance(budget, ApiBudget):
+        budget.reset()
+
+def run_replay(journal_path, target="main", realtime=False, profile_path=None, top=25):
+    """Riproduce un journal attraverso il ciclo di trading scelto, con profiler opzionale."""
+    import api
+    import resilience
+
+    records = read_journal(journal_path)
+    replayer = JournalReplayer(records, realtime=realtime)
+    print(f"🎞️ Replay di {len(records)} richieste da {journal_path} ({'velocità registrata' if realtime else 'massima velocità'})")
+
+    if target == "main":
+        from main import scan_and_trade as loop
+    else:
+        from orders import scan_and_trade_parallel as loop
+
+    api.start_replay(replayer)
+    resilience.seed_jitter(REPLAY_SEED)  # ✅ Backoff con jitter riproducibile tra un replay e l'altro
+    clock = VirtualClock(replayer.start_time) if not realtime else None
+    profiler = ThreadProfiler() if profile_path else None
+    started = time.perf_counter()
+
+    try:
+        if clock:
+            clock.__enter__()
+            _reset_clock_state(api)
+        if profiler:
+            profiler.__enter__()
+        loop()
+    except ReplayExhausted as e:
+        print(f"🏁 Journal esaurito: {e}")
+    finally:
+        if profiler:
+            profiler.__exit__(None, None, None)
+        if clock:
+            clock.__exit__(None, None, None)
+            _reset_clock_state(api)  # ✅ Budget e breaker tornano all'orologio reale per le richieste successive
+        api.stop_replay()
+
+    print(f"⏱️ {replayer.served} risposte riprodotte in {time.perf_counter() - started:.2f}s")
+
+    if profiler:
+        stats = profiler.stats()
+        stats.dump_stats(profile_path)
+        stats.sort_stats("cumulative").print_stats(top)
+        print(f"📊 Profilo salvato in {profile_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Riproduce un journal registrato da api.py")
+    parser.add_argument("journal", help="Percorso del journal registrato")
+    parser.add_argument("--target", choices=["main", "orders"], default="main",
+                        help="Ciclo da riprodurre: main.scan_and_trade o orders.scan_and_trade_parallel")
+    parser.add_argument("--realtime", action="store_true", help="Riproduce alla velocità registrata")
+    parser.add_argument("--profile", metavar="FILE", help="Salva il profilo cProfile in FILE")
+    args = parser.parse_args()
+
+    run_replay(args.journal, target=args.target, realtime=args.realtime, profile_path=args.profile)
@@ -0,0 +1,235 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from email.utils import parsedate_to_datetime
+
+# ✅ Timeout (secondi) per prefisso di endpoint: vince il prefisso più lungo
+DEFAULT_TIMEOUT = 10
+ENDPOINT_TIMEOUTS = {
+    "/v5/market/": 4,
+    "/v5/position/": 6,
+    "/v5/account/": 6,
+    "/v5/order/": 10,
+}
+
+# 📌 Backoff esponenziale con jitter per classe di errore: (attesa base, attesa massima)
+BACKOFF_POLICY = {
+    "rate_limit": (1.0, 15.0),
+    "server": (0.25, 4.0),
+    "timeout": (0.1, 2.0),
+    "connection": (0.5, 5.0),
+}
+
+# 📌 Circuit breaker per endpoint
+BREAKER_FAILURE_THRESHOLD = 5  # Errori consecutivi prima di aprire il circuito
+BREAKER_RESET_TIMEOUT = 15  # Secondi prima di lasciar passare una richiesta di prova
+
+# 📌 Richieste "hedged" per i GET di market data idempotenti
+HEDGE_ENABLED = True
+HEDGED_PREFIXES = ("/v5/market/",)
+HEDGE_MIN_DELAY = 0.05
+HEDGE_DEFAULT_DELAY = 0.5  # Usato finché non ci sono abbastanza latenze osservate
+HEDGE_PERCENTILE = 0.95
+LATENCY_WINDOW = 200
+HEDGE_MAX_INFLIGHT = 4  # Coppie hedged in volo al massimo, comprese le copie perdenti non ancora terminate
+HEDGE_CALLERS = 8  # Thread che chiamano make_request in parallelo (scanner + ciclo principale)
+
+JITTER_SEED = None  # Seme del jitter: il replay lo fissa per avere attese riproducibili
+
+_jitter = random.Random(JITTER_SEED)
+# ✅ Un thread per ogni chiamante più due per ogni coppia hedged: le prime richieste non restano
+# mai in coda dietro alle copie perdenti, che occupano il loro thread fino al timeout
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_CALLERS + 2 * HEDGE_MAX_INFLIGHT, thread_name_prefix="hedge")
+_hedge_slots = threading.BoundedSemaphore(HEDGE_MAX_INFLIGHT)
+
+def _longest_prefix(mapping, endpoint):
+    matches = [prefix for prefix in mapping if endpoint.startswith(prefix)]
+    return max(matches, key=len) if matches else None
+
+def timeout_for(endpoint):
+    """Restituisce il timeout configurato per l'endpoint."""
+    prefix = _longest_prefix(ENDPOINT_TIMEOUTS, endpoint)
+    return ENDPOINT_TIMEOUTS[prefix] if prefix else DEFAULT_TIMEOUT
+
+def classify_status(status_code):
+    """Classifica un codice HTTP: "rate_limit", "server" oppure "client" (non ripetibile)."""
+    if status_code == 429:
+        return "rate_limit"
+    if status_code >= 500:
+        return "server"
+    return "client"
+
+def seed_jitter(seed):
+    """Reinizializza il generatore del jitter con un seme fisso (usato dal replay)."""
+    _jitter.seed(seed)
+
+def parse_retry_after(value):
+    """
+    Interpreta l'header Retry-After, in secondi o come data HTTP.
+    Restituisce i secondi da attendere, oppure None se il valore non è valido.
+    """
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(parsedate_to_datetime(str(value)).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+def backoff_delay(error_class, attempt, retry_after=None):
+    """Attesa prima del tentativo successivo: backoff esponenziale con full jitter."""
+    base, cap = BACKOFF_POLICY[error_class]
+    delay = _jitter.uniform(0, min(cap, base * (2 ** attempt)))
+    retry_after = parse_retry_after(retry_after)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+class CircuitBreaker:
+    """
+    Circuit breaker a tre stati: "closed" lascia passare tutto, "open" rifiuta subito
+    le richieste, "half_open" lascia passare una sola richiesta di prova. Se l'esito
+    della prova non viene mai registrato, dopo `reset_timeout` ne parte un'altra.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Indica se la richiesta può essere inviata."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open" and now - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probe_at = now
+                return True
+            if self.state == "half_open" and now - self._probe_at >= self.reset_timeout:
+                self._probe_at = now  # ⚠️ Prova precedente senza esito: ne lascia passare un'altra
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+class LatencyTracker:
+    """Mantiene le latenze recenti di un endpoint per stimare il ritardo di hedging."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def hedge_delay(self, timeout):
+        """Percentile HEDGE_PERCENTILE delle latenze osservate, limitato a metà del timeout."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < 20:
+            delay = HEDGE_DEFAULT_DELAY
+        else:
+            delay = samples[min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE))]
+        return max(HEDGE_MIN_DELAY, min(delay, timeout / 2))
+
+_breakers = {}
+_latencies = {}
+_registry_lock = threading.Lock()
+
+def get_breaker(endpoint):
+    """Restituisce il circuit breaker dell'endpoint, creandolo se necessario."""
+    with _registry_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker()
+        return breaker
+
+def get_latency_tracker(endpoint):
+    """Restituisce il tracker delle latenze dell'endpoint, creandolo se necessario."""
+    with _registry_lock:
+        tracker = _latencies.get(endpoint)
+        if tracker is None:
+            tracker = _latencies[endpoint] = LatencyTracker()
+        return tracker
+
+def reset_state():
+    """
+    Scarta circuit breaker e latenze di tutti gli endpoint: contengono istanti di time.monotonic
+    e non sono più validi quando l'orologio cambia (es. all'inizio e alla fine di un replay).
+    """
+    with _registry_lock:
+        _breakers.clear()
+        _latencies.clear()
+
+def is_hedgeable(endpoint, method):
+    """Solo i GET di market data sono idempotenti e abbastanza economici da duplicare."""
+    return HEDGE_ENABLED and method == "GET" and endpoint.startswith(HEDGED_PREFIXES)
+
+def _release_when_both_done(primary, hedge):
+    """Libera lo slot di hedging solo quando entrambe le copie sono terminate."""
+    lock = threading.Lock()
+    pending = [2]
+
+    def release(_future):
+        with lock:
+            pending[0] -= 1
+            last = pending[0] == 0
+        if last:
+            _hedge_slots.release()
+
+    primary.add_done_callback(release)
+    hedge.add_done_callback(release)
+
+def hedged_call(func, delay, admit=None):
+    """
+    Esegue `func`; se non termina entro `delay` secondi ne lancia una seconda copia
+    e restituisce il primo risultato valido. L'altra richiesta viene ignorata.
+    La copia parte solo se c'è uno dei HEDGE_MAX_INFLIGHT slot liberi e se `admit()`
+    la autorizza (es. un token del budget API); altrimenti si attende la prima richiesta.
+    """
+    primary = _hedge_executor.submit(func)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+
+    if not _hedge_slots.acquire(blocking=False):
+        return primary.result()
+    if admit is not None and not admit():
+        _hedge_slots.release()
+        return primary.result()
+
+    hedge = _hedge_executor.submit(func)
+    _release_when_both_done(primary, hedge)
+
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                return future.result()
+            except Exception as e:
+                error = e
+    raise error
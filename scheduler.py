@@ -0,0 +1,258 @@
+import heapq
+import math
+import threading
+import time
+
+# ✅ Durata in secondi di ogni timeframe Bybit
+TIMEFRAME_SECONDS = {
+    "1": 60, "3": 180, "5": 300, "15": 900, "30": 1800,
+    "60": 3600, "120": 7200, "240": 14400, "360": 21600, "720": 43200,
+    "D": 86400, "W": 604800,
+}
+
+API_BUDGET_PER_SECOND = 8  # 🔥 Richieste API al secondo condivise da tutti i thread
+API_BUDGET_BURST = 16  # Numero massimo di richieste consecutive senza attesa
+CANDLE_CLOSE_DELAY = 2  # Secondi di attesa dopo la chiusura per avere la candela definitiva
+MAX_DEFER_CYCLES = 3  # Dopo questi rinvii un simbolo passa in testa alla coda
+
+# 📌 Pesi del punteggio di priorità (ogni fattore è normalizzato in [0, 1] prima di essere pesato)
+LIQUIDITY_WEIGHT = 1.0
+VOLATILITY_WEIGHT = 1.0
+PROXIMITY_WEIGHT = 2.0
+
+# 📌 Calcola la prossima chiusura di candela
+def next_candle_close(timeframe, now=None):
+    """Restituisce il timestamp (secondi) della prossima chiusura di candela per il timeframe."""
+    if now is None:
+        now = time.time()
+    period = TIMEFRAME_SECONDS[timeframe]
+    return (math.floor(now / period) + 1) * period
+
+# 📌 Fattori di priorità di un simbolo
+def ticker_factors(ticker):
+    """Restituisce (liquidità, volatilità) grezze: log10 del turnover 24h e range 24h in percentuale."""
+    try:
+        turnover = float(ticker.get("turnover24h", 0) or 0)
+        last = float(ticker.get("lastPrice", 0) or 0)
+        high = float(ticker.get("highPrice24h", 0) or 0)
+        low = float(ticker.get("lowPrice24h", 0) or 0)
+    except (TypeError, ValueError):
+        return 0.0, 0.0
+
+    liquidity = math.log10(turnover) if turnover > 1 else 0.0
+    volatility = (high - low) / last * 100 if last > 0 else 0.0
+    return liquidity, volatility
+
+def percentile_ranks(values):
+    """
+    Normalizza {simbolo: valore} nel rango percentile in [0, 1] sull'universo corrente:
+    il valore più basso vale 0, il più alto 1, i pari merito ricevono il rango medio.
+    """
+    if len(values) < 2:
+        return {symbol: 1.0 for symbol in values}
+
+    ordered = sorted(values.values())
+    positions = {}
+    for index, value in enumerate(ordered):
+        positions.setdefault(value, []).append(index)
+
+    scale = len(ordered) - 1
+    ranks = {value: sum(indexes) / len(indexes) / scale for value, indexes in positions.items()}
+    return {symbol: ranks[value] for symbol, value in values.items()}
+
+# 📌 Calcola la priorità di un simbolo
+def compute_priority(liquidity, volatility, proximity=0.0):
+    """
+    Combina liquidità, volatilità (ranghi percentili nell'universo) e vicinanza al segnale,
+    tutti in [0, 1], in un unico punteggio: più alto è, prima il simbolo viene analizzato.
+    """
+    return LIQUIDITY_WEIGHT * liquidity + VOLATILITY_WEIGHT * volatility + PROXIMITY_WEIGHT * proximity
+
+class ApiBudget:
+    """Token bucket thread-safe che limita le richieste API globali al secondo."""
+
+    def __init__(self, rate=API_BUDGET_PER_SECOND, burst=API_BUDGET_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reset(self):
+        """Riempie il bucket e riparte dall'orologio corrente (es. dopo il cambio di orologio del replay)."""
+        with self._lock:
+            self._tokens = float(self.burst)
+            self._last = time.monotonic()
+
+    def available(self):
+        """Restituisce il numero di token disponibili in questo momento."""
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def try_acquire(self, cost=1):
+        """Consuma `cost` token se disponibili, senza attendere."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= cost:
+                self._tokens -= cost
+                return True
+            return False
+
+    def acquire(self, cost=1, timeout=None):
+        """Attende finché non sono disponibili `cost` token. Restituisce False allo scadere del timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= cost:
+                    self._tokens -= cost
+                    return True
+                wait = (cost - self._tokens) / self.rate
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+class CandleScheduler:
+    """
+    Pianifica l'analisi dei simboli alla chiusura della candela del loro timeframe.
+    I simboli pronti vengono ordinati per priorità e serviti finché c'è budget API;
+    quelli rimasti vengono rinviati al giro successivo.
+    """
+
+    def __init__(self, budget=None, default_timeframe="1", cost_per_symbol=1):
+        self.budget = budget or ApiBudget()
+        self.default_timeframe = default_timeframe
+        self.cost_per_symbol = cost_per_symbol
+        self._lock = threading.Lock()
+        self._queue = []  # Heap di (chiusura, simbolo); le voci superate da _scheduled vengono scartate
+        self._scheduled = {}  # simbolo -> chiusura attualmente pianificata
+        self._timeframes = {}  # simbolo -> timeframe
+        self._factors = {}  # simbolo -> (rango di liquidità, rango di volatilità)
+        self._proximity = {}  # simbolo -> vicinanza al segnale (0..1)
+        self._deferred = {}  # simbolo -> numero di rinvii consecutivi
+
+    def update_universe(self, tickers, timeframe=None):
+        """Aggiorna l'elenco dei simboli da pianificare a partire dai ticker filtrati."""
+        timeframe = timeframe or self.default_timeframe
+        now = time.time()
+        with self._lock:
+            symbols = {ticker["symbol"] for ticker in tickers}
+            factors = {ticker["symbol"]: ticker_factors(ticker) for ticker in tickers}
+            liquidity = percentile_ranks({symbol: value[0] for symbol, value in factors.items()})
+            volatility = percentile_ranks({symbol: value[1] for symbol, value in factors.items()})
+            self._factors = {symbol: (liquidity[symbol], volatility[symbol]) for symbol in factors}
+
+            for symbol in list(self._timeframes):
+                if symbol not in symbols:
+                    del self._timeframes[symbol]
+                    self._scheduled.pop(symbol, None)
+                    self._proximity.pop(symbol, None)
+                    self._deferred.pop(symbol, None)
+
+            for symbol in symbols:
+                if symbol not in self._timeframes:
+                    self._timeframes[symbol] = timeframe
+                    self._schedule(symbol, next_candle_close(timeframe, now))
+
+            self._queue = [(close, symbol) for close, symbol in self._queue if self._scheduled.get(symbol) == close]
+            heapq.heapify(self._queue)
+
+    def _schedule(self, symbol, close):
+        self._scheduled[symbol] = close
+        heapq.heappush(self._queue, (close, symbol))
+
+    def _drop_stale(self):
+        while self._queue and self._scheduled.get(self._queue[0][1]) != self._queue[0][0]:
+            heapq.heappop(self._queue)
+
+    def record_signal_proximity(self, symbol, proximity):
+        """Registra quanto un simbolo è vicino a generare un segnale (0 = lontano, 1 = segnale)."""
+        with self._lock:
+            self._proximity[symbol] = max(0.0, min(1.0, float(proximity)))
+
+    def signal_proximities(self):
+        """Copia delle vicinanze al segnale registrate, per il journal di stato."""
+        with self._lock:
+            return dict(self._proximity)
+
+    def _priority(self, symbol):
+        if self._deferred.get(symbol, 0) >= MAX_DEFER_CYCLES:
+            return math.inf
+        liquidity, volatility = self._factors.get(symbol, (0.0, 0.0))
+        return compute_priority(liquidity, volatility, self._proximity.get(symbol, 0.0))
+
+    def next_batch(self, now=None):
+        """
+        Restituisce i simboli con candela chiusa in ordine di priorità, limitati dal budget API
+        disponibile. Il budget viene consumato da make_request al momento delle richieste;
+        i simboli esclusi restano in coda e vengono ripresentati al prossimo giro.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            due = []
+            self._drop_stale()
+            while self._queue and self._queue[0][0] + CANDLE_CLOSE_DELAY <= now:
+                _, symbol = heapq.heappop(self._queue)
+                due.append(symbol)
+                self._drop_stale()
+
+            due.sort(key=self._priority, reverse=True)
+
+            available = self.budget.available()
+            batch = []
+            for symbol in due:
+                if available >= self.cost_per_symbol:
+                    available -= self.cost_per_symbol
+                    batch.append(symbol)
+                    self._deferred.pop(symbol, None)
+                    self._schedule(symbol, next_candle_close(self._timeframes[symbol], now))
+                else:
+                    # ⏭️ Budget esaurito: il simbolo torna subito disponibile al prossimo giro
+                    self._deferred[symbol] = self._deferred.get(symbol, 0) + 1
+                    self._schedule(symbol, now - CANDLE_CLOSE_DELAY)
+
+            return batch
+
+    def defer(self, symbols, delay=0, now=None):
+        """
+        Rimette in coda simboli già estratti ma non analizzati (es. limite di trade raggiunto):
+        tornano pronti dopo `delay` secondi, senza superare la prossima chiusura di candela.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            for symbol in symbols:
+                if symbol not in self._timeframes:
+                    continue
+                close = min(now + delay - CANDLE_CLOSE_DELAY, next_candle_close(self._timeframes[symbol], now))
+                self._deferred[symbol] = self._deferred.get(symbol, 0) + 1
+                self._schedule(symbol, close)
+
+    def seconds_until_next(self, now=None):
+        """Secondi da attendere prima che il prossimo simbolo sia pronto."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._drop_stale()
+            if not self._queue:
+                return None
+            ready_at = self._queue[0][0] + CANDLE_CLOSE_DELAY
+        if ready_at <= now:
+            # Simboli rinviati: attende il tempo necessario a ricaricare il budget
+            return max(self.cost_per_symbol / self.budget.rate, 0.05)
+        return ready_at - now
+
+    def __len__(self):
+        with self._lock:
+            return len(self._timeframes)
@@ -0,0 +1,334 @@
+import argparse
+import glob
+import os
+import re
+import secrets
+import threading
+import time
+import zlib
+from multiprocessing import Process
+from multiprocessing.managers import BaseManager
+from scheduler import ApiBudget
+
+SHARD_ADDRESS = ("127.0.0.1", 50555)  # Indirizzo del coordinatore (socket locale o di rete)
+UNIVERSE_TTL = 60  # Secondi di validità dell'elenco delle coppie
+POSITIONS_TTL = 30  # Secondi di validità delle posizioni lette dall'exchange
+BALANCE_TTL = 60  # Secondi di validità del saldo
+PENDING_TTL = 120  # Secondi dopo cui uno slot riservato senza posizione visibile viene liberato
+SHARD_JOURNAL = "marla_state_shard{}.journal"  # Journal di stato di ogni shard
+
+# 📌 Partizionamento stabile dell'universo
+def shard_of(symbol, shard_count):
+    """Restituisce lo shard di un simbolo; crc32 è stabile tra processi e macchine, a differenza di hash()."""
+    return zlib.crc32(symbol.encode("utf-8")) % shard_count
+
+# 📌 Ribilanciamento dei journal di stato
+def _journal_symbol(key):
+    """Simbolo a cui appartiene una chiave del journal: il simbolo stesso oppure (simbolo, timeframe)."""
+    return key if isinstance(key, str) else key[0]
+
+def rebalance_journals(shard_count, template=SHARD_JOURNAL):
+    """
+    Sposta ogni record dei journal di stato nel journal dello shard che ora possiede il suo simbolo.
+    Va eseguito prima di avviare i worker: se il numero di shard cambia tra due avvii, posizioni e
+    ordini resterebbero in file che nessun worker ripristina né riconcilia.
+    """
+    from state_journal import StateJournal
+
+    pattern = re.compile(re.escape(template).replace(r"\{\}", r"(\d+)"))
+    paths = {}
+    for path in glob.glob(template.format("*")):
+        match = pattern.fullmatch(path)
+        if match:
+            paths[int(match.group(1))] = path
+    if not paths:
+        return 0
+
+    journals = {}
+
+    def journal_of(index):
+        if index not in journals:
+            journals[index] = StateJournal(template.format(index))
+        return journals[index]
+
+    moved = 0
+    try:
+        for index in sorted(paths):
+            source = journal_of(index)
+            for kind in source.kinds():
+                for key, value in source.items(kind).items():
+                    owner = shard_of(_journal_symbol(key), shard_count)
+                    if owner == index:
+                        continue
+                    # Prima la copia nel nuovo shard, poi la cancellazione: un crash lascia al più un duplicato
+                    journal_of(owner).put(kind, key, value, sync=True)
+                    source.delete(kind, key, sync=True)
+                    moved += 1
+    finally:
+        for index, journal in journals.items():
+            if moved:
+                journal.compact()
+            empty = not journal.live_keys()
+            journal.close()
+            if index >= shard_count and empty:
+                os.remove(template.format(index))  # Shard non più esistente, ormai vuoto
+
+    print(f"🔀 Journal di stato ribilanciati su {shard_count} shard: {moved} record spostati")
+    return moved
+
+class Coordinator:
+    """
+    Stato condiviso tra i worker: universo filtrato, limite globale di trade aperti,
+    saldo dell'account (usato da orders.scan_and_trade per dimensionare i trade) e budget
+    delle richieste API. Vive in un solo processo.
+    """
+
+    def __init__(self, max_open_trades, budget=None):
+        self.max_open_trades = max_open_trades
+        self.budget = budget or ApiBudget()
+        self._lock = threading.Lock()
+        self._tickers = []
+        self._tickers_at = 0.0
+        self._positions = set()
+        self._positions_at = 0.0
+        self._positions_refreshing = False
+        self._pending = {}  # simbolo -> istante della prenotazione
+        self._balance = 0.0
+        self._balance_at = 0.0
+
+    # ✅ Budget API condiviso
+    def budget_rate(self):
+        return self.budget.rate
+
+    def available_budget(self):
+        return self.budget.available()
+
+    def try_acquire_budget(self, cost=1):
+        return self.budget.try_acquire(cost)
+
+    def acquire_budget(self, cost=1, timeout=None):
+        return self.budget.acquire(cost, timeout)
+
+    # ✅ Universo partizionato
+    def get_shard_tickers(self, shard_index, shard_count):
+        """Restituisce i ticker filtrati assegnati allo shard, aggiornandoli se scaduti."""
+        from api import get_filtered_tickers
+
+        with self._lock:
+            stale = time.time() - self._tickers_at >= UNIVERSE_TTL
+            if stale:
+                self._tickers_at = time.time()  # Un solo worker aggiorna, gli altri usano la cache
+
+        if stale:
+            # La richiesta REST avviene fuori dal lock: gli altri worker non restano in attesa
+            tickers = get_filtered_tickers()
+            if tickers:
+                with self._lock:
+                    self._tickers = tickers
+
+        with self._lock:
+            tickers = self._tickers
+
+        return [ticker for ticker in tickers if shard_of(ticker["symbol"], shard_count) == shard_index]
+
+    # ✅ Limite globale dei trade aperti
+    def _refresh_positions(self):
+        """Aggiorna le posizioni dall'exchange se scadute; il lock è preso solo per sostituire la cache."""
+        from orders import fetch_open_positions
+
+        with self._lock:
+            if time.time() - self._positions_at < POSITIONS_TTL or self._positions_refreshing:
+                return
+            self._positions_refreshing = True
+
+        try:
+            positions = fetch_open_positions()
+        finally:
+            with self._lock:
+                self._positions_refreshing = False
+
+        if positions is None:
+            # ⚠️ Errore API: mantiene le posizioni note e riprova alla prossima richiesta
+            print("⚠️ Coordinatore: posizioni non aggiornate, uso l'ultimo stato noto.")
+            return
+
+        with self._lock:
+            self._positions = set(positions)
+            self._positions_at = time.time()
+
+            now = time.time()
+            for symbol, reserved_at in list(self._pending.items()):
+                if symbol in self._positions or now - reserved_at >= PENDING_TTL:
+                    del self._pending[symbol]
+
+    def open_trade_count(self):
+        """Posizioni aperte sull'exchange più gli ordini prenotati non ancora visibili."""
+        self._refresh_positions()
+        with self._lock:
+            return len(self._positions | set(self._pending))
+
+    def position_state(self):
+        """
+        Restituisce (posizioni dell'exchange, istante della lettura, trade aperti o prenotati),
+        usato dai worker per riallineare il proprio journal di stato. L'istante è 0 se mai lette.
+        """
+        self._refresh_positions()
+        with self._lock:
+            return sorted(self._positions), self._positions_at, len(self._positions | set(self._pending))
+
+    def reserve_trade_slot(self, symbol):
+        """Prenota uno slot per aprire un trade su `symbol`. False se il limite globale è raggiunto."""
+        self._refresh_positions()
+        with self._lock:
+            if not self._positions_at:
+                return False  # ⚠️ Posizioni mai lette dall'exchange: non si rischia di superare il limite
+            active = self._positions | set(self._pending)
+            if symbol in active or len(active) >= self.max_open_trades:
+                return False
+            self._pending[symbol] = time.time()
+            return True
+
+    def release_trade_slot(self, symbol):
+        """Libera lo slot prenotato quando l'ordine non è andato a buon fine."""
+        with self._lock:
+            self._pending.pop(symbol, None)
+
+    # ✅ Stato dell'account
+    def get_balance(self):
+        """Saldo USDT condiviso, aggiornato al massimo ogni BALANCE_TTL secondi."""
+        from api import get_balance
+
+        with self._lock:
+            stale = time.time() - self._balance_at >= BALANCE_TTL
+            if stale:
+                self._balance_at = time.time()
+
+        if stale:
+            balance = get_balance()
+            with self._lock:
+                self._balance = balance
+
+        with self._lock:
+            return self._balance
+
+_trade_gate = None
+_trade_gate_lock = threading.Lock()
+
+# 📌 Coordinatore del processo
+def get_trade_gate():
+    """
+    Restituisce il coordinatore che applica il limite globale dei trade: quello condiviso
+    in modalità shard, altrimenti un Coordinator locale creato al primo utilizzo.
+    """
+    global _trade_gate
+    with _trade_gate_lock:
+        if _trade_gate is None:
+            import api
+            from orders import MAX_OPEN_TRADES
+            _trade_gate = Coordinator(MAX_OPEN_TRADES, budget=api.get_request_budget())
+        return _trade_gate
+
+def set_trade_gate(gate):
+    """Sostituisce il coordinatore del processo (es. con quello remoto in un worker shard)."""
+    global _trade_gate
+    with _trade_gate_lock:
+        _trade_gate = gate
+
+class RemoteBudget:
+    """Adattatore con l'interfaccia di ApiBudget che consuma il budget del coordinatore."""
+
+    def __init__(self, coordinator):
+        self._coordinator = coordinator
+        self.rate = coordinator.budget_rate()
+
+    def available(self):
+        return self._coordinator.available_budget()
+
+    def try_acquire(self, cost=1):
+        return self._coordinator.try_acquire_budget(cost)
+
+    def acquire(self, cost=1, timeout=None):
+        return self._coordinator.acquire_budget(cost, timeout)
+
+class _ServerManager(BaseManager):
+    pass
+
+class _ClientManager(BaseManager):
+    pass
+
+_ClientManager.register("coordinator")
+
+# 📌 Processo worker
+def run_worker(shard_index, shard_count, address, authkey):
+    """Analizza solo le coppie del proprio shard usando il coordinatore per limiti e budget."""
+    import api
+    import main
+
+    manager = _ClientManager(address=address, authkey=authkey)
+    manager.connect()
+    coordinator = manager.coordinator()
+
+    budget = RemoteBudget(coordinator)
+    api.set_request_budget(budget)  # ✅ Ogni richiesta del worker consuma il budget condiviso
+    main.scheduler.budget = budget
+    set_trade_gate(coordinator)  # ✅ Limite dei trade applicato dal coordinatore condiviso
+    journal = main.restore_state(SHARD_JOURNAL.format(shard_index))  # ✅ Un journal di stato per shard (vedi rebalance_journals)
+
+    print(f"🧩 Worker {shard_index + 1}/{shard_count} avviato (PID {os.getpid()})")
+    try:
+        main.scan_and_trade(fetch_tickers=lambda: coordinator.get_shard_tickers(shard_index, shard_count))
+    finally:
+        journal.shutdown()  # I processi figli di multiprocessing escono senza eseguire atexit
+
+# 📌 Processo coordinatore
+def run_coordinator(workers, address=SHARD_ADDRESS, authkey=None, local_workers=True):
+    """Avvia il coordinatore e, se richiesto, un processo worker per ogni shard su questa macchina."""
+    import api
+    from main import MAX_OPEN_TRADES
+
+    authkey = authkey or secrets.token_bytes(16)
+    if local_workers:
+        rebalance_journals(workers)  # ✅ Prima di avviare i worker: nessuno sta scrivendo nei journal
+    coordinator = Coordinator(MAX_OPEN_TRADES, budget=api.get_request_budget())  # Anche le sue richieste consumano il budget
+    _ServerManager.register("coordinator", callable=lambda: coordinator)
+
+    server = _ServerManager(address=address, authkey=authkey).get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"🛰️ Coordinatore in ascolto su {address[0]}:{address[1]} per {workers} shard")
+
+    if not local_workers:
+        while True:
+            time.sleep(UNIVERSE_TTL)
+
+    processes = [
+        Process(target=run_worker, args=(index, workers, address, authkey), daemon=True)
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Esegue il bot partizionando le coppie su più processi")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Numero totale di shard")
+    parser.add_argument("--host", default=SHARD_ADDRESS[0], help="Host del coordinatore")
+    parser.add_argument("--port", type=int, default=SHARD_ADDRESS[1], help="Porta del coordinatore")
+    parser.add_argument("--worker-index", type=int, help="Avvia solo il worker indicato e si collega al coordinatore")
+    parser.add_argument("--no-local-workers", action="store_true",
+                        help="Avvia solo il coordinatore: i worker girano su altri nodi")
+    args = parser.parse_args()
+
+    address = (args.host, args.port)
+    env_key = os.environ.get("MARLA_SHARD_AUTHKEY")
+    authkey = env_key.encode("utf-8") if env_key else None
+
+    if args.worker_index is not None:
+        if authkey is None:
+            parser.error("MARLA_SHARD_AUTHKEY è obbligatoria per collegare un worker remoto")
+        run_worker(args.worker_index, args.workers, address, authkey)
+    else:
+        if args.no_local_workers and authkey is None:
+            parser.error("MARLA_SHARD_AUTHKEY è obbligatoria quando i worker girano su altri nodi")
+        print("🚀 Bot avviato in modalità shard!")
+        run_coordinator(args.workers, address, authkey, local_workers=not args.no_local_workers)
@@ -0,0 +1,101 @@
+import numpy as np
+
+# 📌 Regole dei segnali in forma dichiarativa: (etichetta, [(feature, operatore, feature o soglia)])
+# Le regole vengono valutate in ordine: la prima soddisfatta assegna il segnale.
+SIGNAL_RULES = [
+    ("Buy", [
+        ("RSI", ">", 50),
+        ("MACD", ">", "MACD_Signal"),
+        ("close", ">", "VWAP"),
+        ("SuperTrend", ">", 0),
+        ("ADX", ">", 25),
+    ]),
+    ("Sell", [
+        ("RSI", "<", 50),
+        ("MACD", "<", "MACD_Signal"),
+        ("close", "<", "VWAP"),
+        ("SuperTrend", "<", 0),
+        ("ADX", ">", 25),
+    ]),
+]
+NO_SIGNAL = "NO_TRADE"
+
+OPERATORS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+
+def rule_features(rules=SIGNAL_RULES):
+    """Restituisce, in ordine e senza duplicati, le feature usate dalle regole."""
+    features = []
+    for _, conditions in rules:
+        for left, _, right in conditions:
+            for operand in (left, right):
+                if isinstance(operand, str) and operand not in features:
+                    features.append(operand)
+    return features
+
+SIGNAL_FEATURES = rule_features()
+
+def latest_feature_vector(columns, features):
+    """
+    Vettore con l'ultimo valore di ogni feature, letto dall'array della colonna
+    (`columns` è un dizionario nome -> array oppure un DataFrame). Le feature mancanti
+    valgono NaN e non soddisfano nessuna condizione.
+    """
+    vector = np.full(len(features), np.nan, dtype=np.float64)
+    if columns is None:
+        return vector
+    for position, feature in enumerate(features):
+        values = columns.get(feature)
+        if values is not None and len(values):
+            vector[position] = np.asarray(values)[-1]
+    return vector
+
+def latest_feature_matrix(frames, features):
+    """Costruisce la matrice (simboli × feature) con l'ultima riga di ogni simbolo."""
+    return stack_feature_vectors({symbol: latest_feature_vector(columns, features) for symbol, columns in frames.items()}, features)
+
+def stack_feature_vectors(vectors, features):
+    """Impila i vettori {simbolo: vettore} già estratti in una matrice (simboli × feature)."""
+    symbols = list(vectors)
+    if not symbols:
+        return symbols, np.empty((0, len(features)), dtype=np.float64)
+    return symbols, np.vstack([vectors[symbol] for symbol in symbols])
+
+def evaluate_signals(matrix, features, rules=SIGNAL_RULES):
+    """Valuta le regole su tutta la matrice con operazioni vettoriali e restituisce un segnale per riga."""
+    index = {feature: column for column, feature in enumerate(features)}
+    signals = np.full(matrix.shape[0], NO_SIGNAL, dtype=object)
+    decided = np.zeros(matrix.shape[0], dtype=bool)
+
+    for label, conditions in rules:
+        mask = ~decided
+        for left, operator, right in conditions:
+            left_values = matrix[:, index[left]]
+            right_values = matrix[:, index[right]] if isinstance(right, str) else right
+            mask &= OPERATORS[operator](left_values, right_values)
+
+        signals[mask] = label
+        decided |= mask
+
+    return signals
+
+def generate_signals(frames, rules=SIGNAL_RULES):
+    """Genera i segnali Buy/Sell/NO_TRADE per tutti i simboli in un'unica chiamata."""
+    features = rule_features(rules)
+    symbols, matrix = latest_feature_matrix(frames, features)
+    return dict(zip(symbols, evaluate_signals(matrix, features, rules)))
+
+def generate_signals_from_vectors(vectors, rules=SIGNAL_RULES):
+    """
+    Come generate_signals, ma a partire dai vettori di feature già estratti dagli indicatori
+    (in ordine rule_features(rules), vedi strategy.analyze_indicators): nessun accesso ai DataFrame.
+    """
+    features = rule_features(rules)
+    symbols, matrix = stack_feature_vectors(vectors, features)
+    return dict(zip(symbols, evaluate_signals(matrix, features, rules)))
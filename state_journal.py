@@ -0,0 +1,224 @@
+import atexit
+import mmap
+import os
+import pickle
+import signal
+import struct
+import sys
+import threading
+import time
+import zlib
+
+STATE_JOURNAL_PATH = "marla_state.journal"
+JOURNAL_MAGIC = b"MARLAST1"
+RECORD_HEADER = struct.Struct("<II")  # Lunghezza del payload, crc32 del payload
+INITIAL_SIZE = 1 << 22  # 4 MB preallocati, raddoppiati quando servono
+CHECKPOINT_INTERVAL = 300  # Secondi tra una compattazione periodica e l'altra
+COMPACT_RATIO = 4  # Compatta quando i record scritti superano di tanto le chiavi vive
+DURABLE_KINDS = {"position", "pending_order"}  # Scritti su disco subito (msync)
+
+class StateJournal:
+    """
+    Journal di stato append-only su file mappato in memoria. Ogni record è
+    [lunghezza][crc32][pickle di (operazione, tipo, chiave, valore)]: un record
+    scritto a metà da un crash non supera il controllo crc e viene scartato.
+    Lo stato corrente (tipo -> chiave -> valore) è ricostruito all'apertura.
+    """
+
+    def __init__(self, path=STATE_JOURNAL_PATH, initial_size=INITIAL_SIZE):
+        self.path = path
+        self.initial_size = initial_size
+        self._lock = threading.RLock()
+        self._state = {}
+        self._providers = {}
+        self._records = 0
+        self._last_compaction = time.time()
+        self._closed = False
+        self._open()
+        self._load()
+
+    # 📌 Gestione del file mappato
+    def _open(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < len(JOURNAL_MAGIC):
+            with open(self.path, "wb") as journal:
+                journal.write(JOURNAL_MAGIC)
+                journal.truncate(self.initial_size)
+
+        self._file = open(self.path, "r+b")
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        if self._mm[:len(JOURNAL_MAGIC)] != JOURNAL_MAGIC:
+            raise ValueError(f"{self.path} non è un journal di stato valido")
+
+    def _close_map(self):
+        self._mm.flush()
+        self._mm.close()
+        self._file.close()
+
+    def _grow(self, needed):
+        size = max(len(self._mm) * 2, self._offset + needed)
+        self._mm.flush()
+        self._mm.close()
+        self._file.truncate(size)
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+
+    def _load(self):
+        offset = len(JOURNAL_MAGIC)
+        size = len(self._mm)
+        torn = False
+
+        while offset + RECORD_HEADER.size <= size:
+            length, crc = RECORD_HEADER.unpack_from(self._mm, offset)
+            if length == 0:
+                break
+            end = offset + RECORD_HEADER.size + length
+            payload = self._mm[offset + RECORD_HEADER.size:end] if end <= size else b""
+            if end > size or zlib.crc32(payload) != crc:
+                torn = True
+                break
+            self._apply(*pickle.loads(payload))
+            self._records += 1
+            offset = end
+
+        self._offset = offset
+        if torn:
+            # ⚠️ Record interrotto da un crash: azzera la coda per non rileggerlo in futuro
+            print(f"⚠️ Journal di stato troncato a {offset} byte, record incompleto scartato.")
+            self._mm[offset:] = bytes(size - offset)
+
+    def _apply(self, operation, kind, key, value):
+        entries = self._state.setdefault(kind, {})
+        if operation == "put":
+            entries[key] = value
+        else:
+            entries.pop(key, None)
+
+    def _encode(self, operation, kind, key, value):
+        payload = pickle.dumps((operation, kind, key, value), protocol=pickle.HIGHEST_PROTOCOL)
+        return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)), payload
+
+    def _append(self, operation, kind, key, value, sync):
+        header, payload = self._encode(operation, kind, key, value)
+        needed = len(header) + len(payload)
+        with self._lock:
+            if self._offset + needed > len(self._mm):
+                self._grow(needed)
+
+            # Il payload viene scritto prima dell'intestazione: finché questa è vuota il record non esiste
+            start = self._offset + len(header)
+            self._mm[start:start + len(payload)] = payload
+            self._mm[self._offset:start] = header
+            self._offset += needed
+            self._records += 1
+            self._apply(operation, kind, key, value)
+
+            if sync or kind in DURABLE_KINDS:
+                self._mm.flush()
+
+    # 📌 API pubblica
+    def put(self, kind, key, value, sync=False):
+        """Registra il valore corrente di una chiave."""
+        self._append("put", kind, key, value, sync)
+
+    def delete(self, kind, key, sync=False):
+        """Rimuove una chiave dallo stato."""
+        with self._lock:
+            if key not in self._state.get(kind, {}):
+                return
+        self._append("delete", kind, key, None, sync)
+
+    def get(self, kind, key, default=None):
+        with self._lock:
+            return self._state.get(kind, {}).get(key, default)
+
+    def items(self, kind):
+        """Copia dello stato corrente per un tipo di record."""
+        with self._lock:
+            return dict(self._state.get(kind, {}))
+
+    def kinds(self):
+        """Tipi di record presenti nello stato corrente."""
+        with self._lock:
+            return [kind for kind, entries in self._state.items() if entries]
+
+    def register_snapshot(self, kind, provider):
+        """Registra una funzione che restituisce lo stato completo di `kind`, salvato a ogni compattazione."""
+        self._providers[kind] = provider
+
+    def live_keys(self):
+        with self._lock:
+            return sum(len(entries) for entries in self._state.values())
+
+    def compact(self):
+        """Riscrive il journal con un solo record per chiave viva e lo sostituisce in modo atomico."""
+        with self._lock:
+            for kind, provider in self._providers.items():
+                self._state[kind] = dict(provider())
+
+            chunks = [JOURNAL_MAGIC]
+            records = 0
+            for kind, entries in self._state.items():
+                for key, value in entries.items():
+                    chunks.extend(self._encode("put", kind, key, value))
+                    records += 1
+            data = b"".join(chunks)
+
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as journal:
+                journal.write(data)
+                journal.truncate(max(self.initial_size, 2 * len(data)))
+                journal.flush()
+                os.fsync(journal.fileno())
+
+            self._close_map()
+            os.replace(tmp_path, self.path)
+            self._open()
+            self._offset = len(data)
+            self._records = records
+            self._last_compaction = time.time()
+
+        print(f"🗜️ Journal di stato compattato: {records} record, {len(data)} byte")
+
+    def checkpoint(self):
+        """Compatta il journal se è passato CHECKPOINT_INTERVAL o se è cresciuto troppo."""
+        with self._lock:
+            overdue = time.time() - self._last_compaction >= CHECKPOINT_INTERVAL
+            bloated = self._records > COMPACT_RATIO * self.live_keys() + 1000
+        if overdue or bloated:
+            self.compact()
+
+    def close(self):
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._close_map()
+
+    def shutdown(self):
+        """Salva uno snapshot completo (es. le candele) e chiude il journal, all'uscita del processo."""
+        with self._lock:
+            if self._closed:
+                return
+            self.compact()
+            self.close()
+
+_journal = None
+
+def _exit_on_sigterm(signum, frame):
+    sys.exit(0)  # Trasforma SIGTERM in un'uscita ordinata: atexit salva lo snapshot finale
+
+def open_journal(path=STATE_JOURNAL_PATH):
+    """
+    Apre (o crea) il journal di stato del processo. All'uscita del processo, anche per SIGTERM,
+    il journal viene compattato con uno snapshot completo prima di essere chiuso.
+    """
+    global _journal
+    if _journal is None:
+        _journal = StateJournal(path)
+        atexit.register(_journal.shutdown)
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, _exit_on_sigterm)
+        print(f"💾 Journal di stato aperto: {path}")
+    return _journal
+
+def get_journal():
+    """Restituisce il journal di stato del processo, oppure None se non è stato aperto."""
+    return _journal
@@ -1,9 +1,11 @@
 import pandas as pd
 import ta
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import StandardScaler
 import logging
+from signals import generate_signals, latest_feature_vector
 
 # ✅ Configurazione logging
 logging.basicConfig(filename="strategy_log.txt", level=logging.INFO, format="%(asctime)s - %(message)s")
@@ -38,6 +40,35 @@ def compute_vwap(df):
     df["VWAP"] = ta.volume.VolumeWeightedAveragePrice(df["high"], df["low"], df["close"], df["volume"]).volume_weighted_average_price()
     return df
 
+# 📌 Indicatori a finestra calcolati direttamente sulle viste del CandleBuffer
+def _rolling_windows(values, window):
+    """Finestre mobili senza copia (n - window + 1, window) su un array contiguo."""
+    return sliding_window_view(values, window)
+
+def compute_bollinger_bands_view(df, close, window=20, window_dev=2):
+    """Calcola le Bollinger Bands sulla vista dei prezzi di chiusura, senza passare da pandas."""
+    upper = np.full(len(close), np.nan)
+    lower = np.full(len(close), np.nan)
+    if len(close) >= window:
+        windows = _rolling_windows(close, window)
+        mean = windows.mean(axis=1)
+        std = windows.std(axis=1)  # ddof=0 come in ta
+        upper[window - 1:] = mean + window_dev * std
+        lower[window - 1:] = mean - window_dev * std
+    df["BB_Upper"] = upper
+    df["BB_Lower"] = lower
+    return df
+
+def compute_vwap_view(df, high, low, close, volume, window=14):
+    """Calcola il VWAP mobile sulle viste del buffer, con la stessa finestra di ta."""
+    vwap = np.full(len(close), np.nan)
+    if len(close) >= window:
+        price_volume = (high + low + close) / 3 * volume
+        with np.errstate(divide="ignore", invalid="ignore"):
+            vwap[window - 1:] = _rolling_windows(price_volume, window).sum(axis=1) / _rolling_windows(volume, window).sum(axis=1)
+    df["VWAP"] = vwap
+    return df
+
 def compute_adx(df):
     """Calcola ADX (Average Directional Index)."""
     df["ADX"] = ta.trend.ADXIndicator(df["high"], df["low"], df["close"], window=14).adx()
@@ -83,50 +114,43 @@ def compute_williams_r(df):
     return df
 
 # 📌 Analisi completa degli indicatori
-def analyze_indicators(df):
-    """Analizza RSI, MACD, Bollinger Bands, VWAP, ADX, SuperTrend e altri indicatori avanzati."""
-    df = compute_rsi(df)
-    df = compute_atr(df)
-    df = compute_macd(df)
-    df = compute_bollinger_bands(df)
-    df = compute_vwap(df)
-    df = compute_adx(df)
-    df = compute_supertrend(df)
-    df = compute_ema(df)
-    df = compute_trend(df)
-    df = compute_mfi(df)
-    df = compute_cci(df)
-    df = compute_stochastic_oscillator(df)
-    df = compute_williams_r(df)
-    return df
+def analyze_indicators(df, buffer=None, features=None):
+    """
+    Analizza RSI, MACD, Bollinger Bands, VWAP, ADX, SuperTrend e altri indicatori avanzati.
+    Con `buffer` (il CandleBuffer da cui deriva df) Bollinger Bands e VWAP leggono direttamente le sue viste.
+    Gli indicatori sono calcolati su un dizionario di colonne e il DataFrame viene assemblato una sola volta.
+    Con `features` restituisce (df, vettore): il vettore contiene l'ultimo valore di ogni feature,
+    letto dagli array degli indicatori senza accedere al DataFrame (vedi signals.generate_signals_from_vectors).
+    """
+    columns = dict(df.items())
+    columns = compute_rsi(columns)
+    columns = compute_atr(columns)
+    columns = compute_macd(columns)
+    if buffer is not None:
+        columns = compute_bollinger_bands_view(columns, buffer.view("close"))
+        columns = compute_vwap_view(columns, buffer.view("high"), buffer.view("low"), buffer.view("close"), buffer.view("volume"))
+    else:
+        columns = compute_bollinger_bands(columns)
+        columns = compute_vwap(columns)
+    columns = compute_adx(columns)
+    columns = compute_supertrend(columns)
+    columns = compute_ema(columns)
+    columns = compute_trend(columns)
+    columns = compute_mfi(columns)
+    columns = compute_cci(columns)
+    columns = compute_stochastic_oscillator(columns)
+    columns = compute_williams_r(columns)
+
+    arrays = {name: values.to_numpy() if isinstance(values, pd.Series) else values for name, values in columns.items()}
+    df = pd.DataFrame(arrays, index=df.index)
+    if features is None:
+        return df
+    return df, latest_feature_vector(arrays, features)
 
 # 📌 Generazione dei segnali di trading
 def generate_trade_signal(df):
-    """Genera segnali di trading usando indicatori e Machine Learning."""
-    latest = df.iloc[-1]
-
-    long_condition = (
-        latest["RSI"] > 50 and
-        latest["MACD"] > latest["MACD_Signal"] and
-        latest["close"] > latest["VWAP"] and
-        latest["SuperTrend"] > 0 and
-        latest["ADX"] > 25
-    )
-
-    short_condition = (
-        latest["RSI"] < 50 and
-        latest["MACD"] < latest["MACD_Signal"] and
-        latest["close"] < latest["VWAP"] and
-        latest["SuperTrend"] < 0 and
-        latest["ADX"] > 25
-    )
-
-    if long_condition:
-        return "Buy"
-    elif short_condition:
-        return "Sell"
-    else:
-        return "NO_TRADE"
+    """Genera il segnale di trading per un singolo simbolo usando le regole di signals.SIGNAL_RULES."""
+    return generate_signals({"symbol": df})["symbol"]
 
 # 📌 Calcolo dei livelli di Take Profit, Stop Loss e Trailing Stop
 def calculate_trade_levels(entry_price, side):